@@ -1,94 +1,457 @@
+import asyncio
+import os
+import random
 import re
-from io import BytesIO
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from operator import attrgetter
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 
-import aiohttp
 import httpx
 import jinja2
-import markdown
-from PIL import Image, UnidentifiedImageError
+import orjson
 
 from astrbot.api import AstrBotConfig, logger
 from astrbot.api.event import AstrMessageEvent, filter
 from astrbot.api.star import Context, Star, register
 from astrbot.core.utils.t2i.renderer import HtmlRenderer
 
+PLUGIN_VERSION = "1.4.0"
 PLUGIN_API_URLS = [
     "https://api.soulter.top/astrbot/plugins",
     "https://plugin.astrbot.uk",
 ]
-GITHUB_REPO_REGEX = re.compile(r"^https?://github\.com/([^/]+)/([^/]+?)(\.git)?$")
+GITHUB_REPO_REGEX = re.compile(
+    r"https?://github\.com/([^/]+)/([^/]+?)(?:\.git)?", re.ASCII
+)
+GITHUB_URL_PREFIXES = ("https://github.com/", "http://github.com/")
 PROXY_TEST_URL = "https://api.github.com"
+PLUGIN_DATA_TTL = 300
+PLUGIN_DATA_RETRY_AFTER = 30
+IMAGE_HEADER_BYTES = 100
+README_MAX_CHARS = 256 * 1024
+HTTP_RETRIES = 3
+HTTP_BACKOFF_BASE = 0.5
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_FAILURE_WINDOW = 60
+CIRCUIT_OPEN_SECONDS = 30
+RENDER_HEDGE_DELAY = 2.0
+FETCH_HEDGE_DELAY = 3.0
+RENDER_CACHE_SIZE = 64
+
+_JINJA_CACHE_DIR = Path("./data/cache/astrbot_plugin_market_jinja")
+_JINJA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+_TEMPLATE_ENV = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(Path(__file__).parent / "templates"),
+    autoescape=jinja2.select_autoescape(["html", "xml"]),
+    auto_reload=False,
+    cache_size=50,
+    bytecode_cache=jinja2.FileSystemBytecodeCache(str(_JINJA_CACHE_DIR)),
+)
+_PLUGIN_LIST_TPL = _TEMPLATE_ENV.get_template("plugin_list_template.html")
+_README_TPL = _TEMPLATE_ENV.get_template("readme_template.html")
+_MD = None
+
+_GET_NAME = attrgetter("name")
+
+
+def _get_markdown():
+    """首次渲染README时才导入markdown并创建转换器，之后复用同一实例"""
+    global _MD
+    if _MD is None:
+        import markdown
+
+        _MD = markdown.Markdown(extensions=["fenced_code", "tables"])
+    return _MD
+
+
+def _looks_like_image(header: bytes) -> bool:
+    """通过文件头魔数判断是否为PNG/JPEG/WebP图片"""
+    return (
+        header.startswith(b"\x89PNG\r\n\x1a\n")
+        or header.startswith(b"\xff\xd8\xff")
+        or (header[:4] == b"RIFF" and header[8:12] == b"WEBP")
+    )
+
+
+def _updated_at_key(item: Tuple[str, Dict[str, Any]]) -> str:
+    return str(item[1].get("updated_at") or "")
+
+
+def _stars_key(item: Tuple[str, Dict[str, Any]]) -> int:
+    # 个别条目的stars可能是字符串或其他类型，无法转换时按0处理，避免排序时类型不一致
+    try:
+        return int(item[1].get("stars") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+@lru_cache(maxsize=128)
+def _parse_search_tokens(term: str) -> Tuple[str, ...]:
+    """拆分搜索词并去重，按长度降序排列，最长（通常最具区分度）的词先扫描"""
+    return tuple(sorted(set(term.lower().split()), key=len, reverse=True))
+
+
+@lru_cache(maxsize=4096)
+def _format_time(time_str: str) -> str:
+    """格式化时间显示，相同的时间字符串在多次渲染间复用结果"""
+    if not time_str:
+        return "未知时间"
+    try:
+        if "T" in time_str and "Z" in time_str:
+            return time_str.replace("T", " ").split(".")[0].split("Z")[0]
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(time_str, fmt).strftime("%Y-%m-%d %H:%M")
+            except ValueError:
+                pass
+        return time_str
+    except Exception as e:
+        logger.warning(f"时间格式解析失败: {time_str}, 错误: {e}")
+        return time_str
 
 
 @register(
     "astrbot_plugin_market",
     "长安某",
     "插件市场",
-    "1.4.0",
+    PLUGIN_VERSION,
     "https://github.com/zgojin/astrbot_plugin_market",
 )
 class PluginMarket(Star):
     def __init__(self, context: Context, config: AstrBotConfig):
         super().__init__(context)
         self.config = config
-        self.session = aiohttp.ClientSession()
         self.plugins_data = {}
+        self._plugin_keys: Tuple[str, ...] = ()
+        self._sorted_keys: Tuple[str, ...] = ()
+        self._key_to_index: Dict[str, int] = {}
+        self._lower_key_map: Dict[str, str] = {}
+        self._plugin_items: List[Dict[str, Any]] = []
+        self._ranked_plugins: Dict[str, List[Dict[str, Any]]] = {}
+        self._haystacks: Tuple[str, ...] = ()
+        self._search_corpus = ""
+        self._corpus_starts: List[int] = []
+        self._fresh_until: Optional[float] = None
+        self._fetch_lock = asyncio.Lock()
+        self._catalog_source: Optional[str] = None
+        self._catalog_validators: Dict[str, str] = {}
+        self._endpoint_health: Dict[str, Tuple[int, float]] = {}
+        self._probing_endpoints: Set[str] = set()
+        self._last_good_endpoint: Optional[str] = None
         self.page_size = 10
+        self.plugin_data_ttl = self.config.get("plugin_data_ttl", PLUGIN_DATA_TTL)
         self.plugins_dir = Path("./data/plugins")
         self.plugin_manager = context._star_manager
-        self.httpx_async_client = httpx.AsyncClient()
-        endpoints = self.config.get(
-            "render_endpoints", ["https://t2i.soulter.top/text2img"]
-        )
-        self.renderer = HtmlRenderer(endpoints[0] if endpoints else "")
-        self.template_env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(Path(__file__).parent / "templates"),
-            autoescape=True,
+        self.httpx_async_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=50, max_keepalive_connections=20, keepalive_expiry=60
+            ),
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            follow_redirects=True,
+            headers={"User-Agent": f"astrbot-plugin-market/{PLUGIN_VERSION}"},
         )
+        self._renderers: Dict[str, HtmlRenderer] = {}
+        # 以HTML内容为键缓存渲染结果，数据刷新后HTML变化，旧条目自然不再命中
+        self._render_cache: OrderedDict[str, str] = OrderedDict()
+        self._render_inflight: Dict[str, asyncio.Task] = {}
 
     async def on_load(self):
         await self.fetch_plugin_data()
 
     async def on_unload(self):
-        if self.session:
-            await self.session.close()
         if self.httpx_async_client:
             await self.httpx_async_client.aclose()
 
     async def fetch_plugin_data(self):
-        """获取插件数据，支持多API地址重试"""
-        for i, api_url in enumerate(PLUGIN_API_URLS):
-            try:
-                logger.info(
-                    f"尝试从插件API地址 {i + 1}/{len(PLUGIN_API_URLS)} 获取数据: {api_url}"
+        """优先向上次的数据来源发送条件请求，响应过慢或失败时再依次启用其他API地址"""
+        candidates = self._healthy_endpoints(PLUGIN_API_URLS)
+        # 上次的数据来源可以发送条件请求，多数情况下一次304即可完成刷新
+        candidates.sort(key=lambda c: c[1] != self._catalog_source)
+        pending = set()
+        launched = 0
+
+        def launch_next():
+            nonlocal launched
+            i, api_url = candidates[launched]
+            launched += 1
+            pending.add(asyncio.create_task(self._fetch_from_api(i, api_url)))
+
+        launch_next()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=FETCH_HEDGE_DELAY,
+                    return_when=asyncio.FIRST_COMPLETED,
                 )
-                async with self.session.get(api_url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        self.plugins_data = {
-                            k: v for k, v in data.items() if "repo" in v
-                        }
-                        logger.info(
-                            f"成功从插件API地址 {i + 1} 获取到 {len(self.plugins_data)} 个插件数据"
-                        )
-                        return
+                if not done:
+                    # 当前地址迟迟未返回，并行启动下一个地址，先成功者胜出
+                    if launched < len(candidates):
+                        logger.warning("插件API响应较慢，同时尝试下一个插件API地址...")
+                        launch_next()
+                    continue
+                # 逐个取出本轮完成的结果，同时失败的任务其异常也会被读取
+                result = None
+                for task in done:
+                    pending.discard(task)
+                    try:
+                        task_result = task.result()
+                    except Exception as e:
+                        logger.error(str(e))
                     else:
-                        logger.warning(
-                            f"从插件API地址 {i + 1} 获取数据失败，状态码: {response.status}"
-                        )
-            except Exception as e:
-                logger.error(f"从插件API地址 {i + 1} 获取数据异常: {str(e)}")
-                if i < len(PLUGIN_API_URLS) - 1:
+                        result = result or task_result
+                if result:
+                    self._apply_fetch_result(*result)
+                    return
+                # 本轮完成的请求均失败，立即补上下一个地址
+                if launched < len(candidates):
                     logger.warning("正在尝试下一个插件API地址...")
+                    launch_next()
+        finally:
+            # 已有结果时取消仍在进行的其他请求
+            for task in pending:
+                task.cancel()
+        # 全部失败后短时间内不再请求，避免故障期间每条命令都等待完整的重试流程
+        self._mark_fresh(min(PLUGIN_DATA_RETRY_AFTER, self.plugin_data_ttl))
+        if self.plugins_data:
+            # 保留上次成功获取的数据及索引
+            logger.error("所有插件API地址均无法获取数据，继续使用上次获取的插件数据")
+            return
         logger.error("所有插件API地址均无法获取数据")
-        self.plugins_data = {}
+        self._catalog_source = None
 
-    def sort_plugins(self, plugins):
-        """按插件在plugins_data中的原始索引（实际编号）排序"""
-        original_order = list(self.plugins_data.keys())
-        return sorted(plugins.items(), key=lambda x: original_order.index(x[0]))
+    def _apply_fetch_result(
+        self,
+        i: int,
+        api_url: str,
+        response: httpx.Response,
+        indexes: Optional[Dict[str, Any]],
+    ):
+        """采用某个API地址的请求结果，indexes为None表示数据未变化"""
+        if indexes is None:
+            self._mark_fresh(self.plugin_data_ttl)
+            logger.info(f"插件API地址 {i + 1} 数据未变化，继续使用缓存")
+            return
+        # 新数据与全部索引已完整构建，一次性替换，避免出现新旧混用的中间状态
+        for name, value in indexes.items():
+            setattr(self, name, value)
+        self._mark_fresh(self.plugin_data_ttl)
+        self._catalog_source = api_url
+        self._catalog_validators = {}
+        if etag := response.headers.get("ETag"):
+            self._catalog_validators["If-None-Match"] = etag
+        if last_modified := response.headers.get("Last-Modified"):
+            self._catalog_validators["If-Modified-Since"] = last_modified
+        logger.info(
+            f"成功从插件API地址 {i + 1} 获取到 {len(self.plugins_data)} 个插件数据"
+        )
+
+    async def _fetch_from_api(
+        self, i: int, api_url: str
+    ) -> Tuple[int, str, httpx.Response, Optional[Dict[str, Any]]]:
+        """请求单个插件API地址并构建索引，数据未变化(304)时返回的indexes为None，失败时抛出异常"""
+        logger.info(
+            f"尝试从插件API地址 {i + 1}/{len(PLUGIN_API_URLS)} 获取数据: {api_url}"
+        )
+        headers = (
+            self._catalog_validators
+            if api_url == self._catalog_source and self.plugins_data
+            else None
+        )
+        try:
+            with self._probe_guard(api_url):
+                response = await self._get_with_retry(api_url, headers=headers)
+            if response.status_code == 304:
+                indexes = None
+            elif response.status_code == 200:
+                payload = orjson.loads(response.content)
+                if not isinstance(payload, dict):
+                    raise RuntimeError(
+                        f"插件API地址 {i + 1} 返回的数据格式不正确: {type(payload).__name__}"
+                    )
+                indexes = self._build_indexes(
+                    {
+                        k: v
+                        for k, v in payload.items()
+                        if isinstance(v, dict) and "repo" in v
+                    }
+                )
+            elif 400 <= response.status_code < 500:
+                raise RuntimeError(
+                    f"插件API地址 {i + 1} 返回客户端错误 {response.status_code}，不再重试该地址"
+                )
+            else:
+                raise RuntimeError(
+                    f"从插件API地址 {i + 1} 获取数据失败，状态码: {response.status_code}"
+                )
+        except RuntimeError:
+            self._record_endpoint_failure(api_url)
+            raise
+        except Exception as e:
+            self._record_endpoint_failure(api_url)
+            raise RuntimeError(f"从插件API地址 {i + 1} 获取数据异常: {str(e)}") from e
+        self._record_endpoint_success(api_url)
+        return i, api_url, response, indexes
+
+    def _circuit_open(self, endpoint: str) -> bool:
+        """地址连续失败达到阈值，且仍在熔断期内或已有探测请求在进行时返回True"""
+        failures, last_failed_at = self._endpoint_health.get(endpoint, (0, 0.0))
+        if failures < CIRCUIT_FAILURE_THRESHOLD:
+            return False
+        return (
+            asyncio.get_running_loop().time() - last_failed_at < CIRCUIT_OPEN_SECONDS
+            or endpoint in self._probing_endpoints
+        )
+
+    @contextmanager
+    def _probe_guard(self, endpoint: str):
+        """熔断期过后实际发出的请求作为探测，进行期间其他调用方仍视该地址为熔断"""
+        failures, _ = self._endpoint_health.get(endpoint, (0, 0.0))
+        probing = (
+            failures >= CIRCUIT_FAILURE_THRESHOLD
+            and endpoint not in self._probing_endpoints
+        )
+        if probing:
+            self._probing_endpoints.add(endpoint)
+        try:
+            yield
+        finally:
+            if probing:
+                self._probing_endpoints.discard(endpoint)
+
+    def _healthy_endpoints(self, endpoints: List[str]) -> List[Tuple[int, str]]:
+        """返回未熔断的地址及其序号，所有地址均熔断时全部返回，避免彻底不可用"""
+        circuit_open = [self._circuit_open(url) for url in endpoints]
+        if all(circuit_open):
+            return list(enumerate(endpoints))
+        skipped = [url for url, is_open in zip(endpoints, circuit_open) if is_open]
+        if skipped:
+            logger.info(f"以下地址近期连续失败，暂时跳过: {', '.join(skipped)}")
+        return [(i, url) for i, url in enumerate(endpoints) if not circuit_open[i]]
+
+    def _record_endpoint_success(self, endpoint: str):
+        self._endpoint_health.pop(endpoint, None)
+
+    def _record_endpoint_failure(self, endpoint: str):
+        now = asyncio.get_running_loop().time()
+        failures, last_failed_at = self._endpoint_health.get(endpoint, (0, 0.0))
+        # 已熔断的地址不按时间窗口清零，探测失败即重新熔断
+        if (
+            failures < CIRCUIT_FAILURE_THRESHOLD
+            and now - last_failed_at > CIRCUIT_FAILURE_WINDOW
+        ):
+            failures = 0
+        self._endpoint_health[endpoint] = (failures + 1, now)
+
+    async def _get_with_retry(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> httpx.Response:
+        """发送GET请求，超时、网络错误、429或5xx时按带抖动的指数退避重试"""
+        for attempt in range(HTTP_RETRIES - 1):
+            try:
+                response = await self.httpx_async_client.get(url, headers=headers)
+                # 除429限流外，4xx属于请求本身的问题，重试无意义，直接交给调用方处理
+                if response.status_code < 500 and response.status_code != 429:
+                    return response
+                reason = f"状态码 {response.status_code}"
+            except httpx.TransportError as e:
+                reason = repr(e)
+            delay = HTTP_BACKOFF_BASE * 2**attempt * random.uniform(0.5, 1.5)
+            logger.warning(f"请求 {url} 失败（{reason}），{delay:.2f}秒后重试...")
+            await asyncio.sleep(delay)
+        return await self.httpx_async_client.get(url, headers=headers)
+
+    def _build_indexes(self, plugins_data: Dict[str, Any]) -> Dict[str, Any]:
+        """根据插件数据构建编号、排序与搜索缓存，只返回结果而不修改实例状态"""
+        plugin_keys = tuple(plugins_data)
+        sorted_keys = tuple(sorted(plugins_data))
+        key_to_index = {k: i for i, k in enumerate(plugin_keys)}
+        # 列表展示用的完整条目，各命令分页时直接切片，无需逐条拼装
+        plugin_items = [
+            {
+                "index": i + 1,
+                "key": k,
+                "author": str(v.get("author", "未标注作者")),
+                "desc": str(v.get("desc", "无描述信息")),
+                "stars": v.get("stars", 0),
+                "updated_at": _format_time(str(v.get("updated_at") or "")),
+            }
+            for i, (k, v) in enumerate(plugins_data.items())
+        ]
+        items = list(plugins_data.items())
+        ranked_plugins = {
+            sort_type: [
+                plugin_items[key_to_index[k]]
+                for k, _ in sorted(items, key=sort_key, reverse=True)
+            ]
+            for sort_type, sort_key in (
+                ("time", _updated_at_key),
+                ("star", _stars_key),
+            )
+        }
+        # 用\x1f分隔各字段，避免关键词跨字段误匹配
+        haystacks = tuple(
+            "\x1f".join(
+                (
+                    key,
+                    str(plugins_data[key].get("desc") or ""),
+                    str(plugins_data[key].get("author") or ""),
+                )
+            ).lower()
+            for key in sorted_keys
+        )
+        corpus_starts = []
+        offset = 0
+        for haystack in haystacks:
+            corpus_starts.append(offset)
+            offset += len(haystack) + 1
+        return {
+            "plugins_data": plugins_data,
+            "_plugin_keys": plugin_keys,
+            "_sorted_keys": sorted_keys,
+            "_key_to_index": key_to_index,
+            # 倒序构建，大小写冲突时保留编号靠前的键名，与逐个查找的结果一致
+            "_lower_key_map": {k.lower(): k for k in reversed(plugin_keys)},
+            "_plugin_items": plugin_items,
+            "_ranked_plugins": ranked_plugins,
+            "_haystacks": haystacks,
+            # 所有haystack拼成一个大字符串，单次str.find即可在C层扫描全部插件
+            "_search_corpus": "\n".join(haystacks),
+            "_corpus_starts": corpus_starts,
+        }
+
+    def _paginate(self, total_items: int, page: int) -> Tuple[int, int, int, int]:
+        """计算分页，返回(修正后的页码, 总页数, 起始下标, 结束下标)"""
+        page_size = self.page_size
+        total_pages = -(-total_items // page_size)
+        page = max(1, min(page, total_pages))
+        start_idx = (page - 1) * page_size
+        return page, total_pages, start_idx, start_idx + page_size
+
+    def _mark_fresh(self, seconds: float):
+        self._fresh_until = asyncio.get_running_loop().time() + seconds
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._fresh_until is not None
+            and asyncio.get_running_loop().time() < self._fresh_until
+        )
+
+    async def _ensure_fresh(self, force: bool = False):
+        """插件数据在缓存有效期内则直接复用，否则重新获取；并发调用只会触发一次请求"""
+        if not force and self._is_fresh():
+            return
+        async with self._fetch_lock:
+            # 等锁期间其他协程可能已完成刷新
+            if not force and self._is_fresh():
+                return
+            await self.fetch_plugin_data()
 
     async def render_with_fallback(self, html_content, data={}):
         """从配置动态读取渲染地址列表，并验证返回的是否为有效图片"""
@@ -96,7 +459,7 @@ class PluginMarket(Star):
         if not endpoints:
             raise RuntimeError("插件配置中未设置任何图片渲染地址")
         attempts = []
-        for i, endpoint in enumerate(endpoints):
+        for i, endpoint in self._healthy_endpoints(endpoints):
             address_number = i + 1
             endpoint_name = (
                 "第一个地址 (主地址)"
@@ -104,51 +467,102 @@ class PluginMarket(Star):
                 else f"第{address_number}个地址 (备用)"
             )
             attempts.append((endpoint, endpoint_name))
+        # 上次成功的地址优先，其余保持配置顺序
+        attempts.sort(key=lambda a: a[0] != self._last_good_endpoint)
         last_error = None
-        for i, (endpoint, endpoint_name) in enumerate(attempts):
-            try:
-                logger.info(
-                    f"开始渲染尝试 {i + 1}/{len(attempts)}：使用{endpoint_name} {endpoint}"
-                )
-                self.renderer.set_network_endpoint(endpoint)
-                img_local_path = await self.renderer.render_custom_template(
-                    html_content, data
+        pending: Dict[asyncio.Task, Tuple[int, str]] = {}
+        launched = 0
+
+        def launch_next():
+            nonlocal launched
+            endpoint, endpoint_name = attempts[launched]
+            launched += 1
+            logger.info(
+                f"开始渲染尝试 {launched}/{len(attempts)}：使用{endpoint_name} {endpoint}"
+            )
+            task = asyncio.create_task(
+                self._render_on_endpoint(endpoint, endpoint_name, html_content, data)
+            )
+            pending[task] = (launched, endpoint_name)
+
+        launch_next()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=RENDER_HEDGE_DELAY,
+                    return_when=asyncio.FIRST_COMPLETED,
                 )
-                if not img_local_path or not isinstance(img_local_path, str):
-                    raise RuntimeError("渲染服务未返回有效的文件路径")
-                logger.info("验证图片有效性...")
-                try:
-                    with open(img_local_path, "rb") as f:
-                        image_data = f.read()
-                except FileNotFoundError:
-                    raise RuntimeError(
-                        f"渲染器返回的路径无效或文件不存在: {img_local_path}"
-                    )
-                image_stream = BytesIO(image_data)
-                try:
-                    with Image.open(image_stream) as img:
-                        img.verify()
-                except UnidentifiedImageError:
-                    error_message_preview = image_data.decode("utf-8", errors="ignore")[
-                        :100
-                    ]
-                    raise RuntimeError(
-                        f"文件内容不是有效的图片内容预览: '{error_message_preview}... '"
-                    )
-                except Exception as img_err:
-                    raise RuntimeError(f"验证图像时发生未知错误: {img_err}")
-                logger.info(f"成功使用 {endpoint_name} 渲染并验证为有效图片")
-                return img_local_path
-            except Exception as e:
-                last_error = e
-                logger.error(f"渲染尝试 {i + 1} ({endpoint_name}) 失败: {str(e)}")
-                if i < len(attempts) - 1:
-                    logger.warning("正在切换到下一个渲染地址...")
+                if not done:
+                    # 当前地址迟迟未返回，并行启动下一个地址，先成功者胜出
+                    if launched < len(attempts):
+                        logger.warning("渲染响应较慢，同时尝试下一个渲染地址...")
+                        launch_next()
                     continue
+                # 逐个取出本轮完成的结果，同时失败的任务其异常也会被读取
+                img_local_path = None
+                for task in done:
+                    attempt_number, endpoint_name = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        last_error = e
+                        logger.error(
+                            f"渲染尝试 {attempt_number} ({endpoint_name}) 失败: {str(e)}"
+                        )
+                    else:
+                        img_local_path = img_local_path or result
+                if img_local_path:
+                    return img_local_path
+                # 本轮完成的尝试均失败，立即补上下一个地址
+                if launched < len(attempts):
+                    logger.warning("正在切换到下一个渲染地址...")
+                    launch_next()
+        finally:
+            for task in pending:
+                task.cancel()
         raise RuntimeError(
             f"所有渲染地址（共{len(attempts)}个）均失败最后一次错误: {last_error}"
         )
 
+    async def _render_on_endpoint(
+        self, endpoint: str, endpoint_name: str, html_content: str, data: dict
+    ) -> str:
+        """使用指定渲染地址渲染并校验图片，并记录该地址的健康状态"""
+        renderer = self._renderers.get(endpoint)
+        if renderer is None:
+            # 每个地址独立一个渲染器，并行渲染时互不干扰
+            renderer = self._renderers[endpoint] = HtmlRenderer(endpoint)
+        try:
+            with self._probe_guard(endpoint):
+                img_local_path = await renderer.render_custom_template(
+                    html_content, data
+                )
+            if not img_local_path or not isinstance(img_local_path, str):
+                raise RuntimeError("渲染服务未返回有效的文件路径")
+            logger.info("验证图片有效性...")
+            await asyncio.to_thread(self._verify_rendered_image, img_local_path)
+        except Exception:
+            self._record_endpoint_failure(endpoint)
+            raise
+        logger.info(f"成功使用 {endpoint_name} 渲染并验证为有效图片")
+        self._record_endpoint_success(endpoint)
+        self._last_good_endpoint = endpoint
+        return img_local_path
+
+    def _verify_rendered_image(self, img_local_path: str):
+        """只读取文件头校验渲染结果是否为图片，涉及磁盘IO，需在线程中调用"""
+        try:
+            with open(img_local_path, "rb") as f:
+                header = f.read(IMAGE_HEADER_BYTES)
+        except FileNotFoundError:
+            raise RuntimeError(f"渲染器返回的路径无效或文件不存在: {img_local_path}")
+        if not _looks_like_image(header):
+            error_message_preview = header.decode("utf-8", errors="ignore")
+            raise RuntimeError(
+                f"文件内容不是有效的图片内容预览: '{error_message_preview}... '"
+            )
+
     async def render_plugin_list_image(
         self,
         plugins: List[Dict[str, Any]],
@@ -173,46 +587,49 @@ class PluginMarket(Star):
             "next_page_command": next_page_command,
         }
         try:
-            template = self.template_env.get_template("plugin_list_template.html")
-            html_content = template.render(**render_data)
-            return await self.render_with_fallback(html_content, {})
+            html_content = _PLUGIN_LIST_TPL.render(**render_data)
+            return await self._render_cached(html_content)
         except Exception as e:
             logger.error(f"模板渲染失败: {str(e)}")
             raise
 
+    async def _render_cached(self, html_content: str) -> str:
+        """复用相同HTML的渲染结果，同时进行的相同渲染请求合并为一次"""
+        img_local_path = self._render_cache.get(html_content)
+        if img_local_path is not None:
+            if os.path.isfile(img_local_path):
+                self._render_cache.move_to_end(html_content)
+                return img_local_path
+            del self._render_cache[html_content]
+        task = self._render_inflight.get(html_content)
+        if task is None:
+            task = asyncio.create_task(self._render_and_store(html_content))
+            self._render_inflight[html_content] = task
+        # shield保证某个请求方被取消时不会中断其他方共享的渲染
+        return await asyncio.shield(task)
+
+    async def _render_and_store(self, html_content: str) -> str:
+        try:
+            img_local_path = await self.render_with_fallback(html_content, {})
+        finally:
+            self._render_inflight.pop(html_content, None)
+        self._render_cache[html_content] = img_local_path
+        if len(self._render_cache) > RENDER_CACHE_SIZE:
+            self._render_cache.popitem(last=False)
+        return img_local_path
+
     @filter.command("插件市场")
     async def show_plugin_market(self, event: AstrMessageEvent):
-        """显示官方插件市场列表"""
-        await self.fetch_plugin_data()
-        args = event.message_str.strip().split()
+        """显示官方插件市场列表，附带“刷新”参数时强制重新获取数据"""
+        args = event.message_str.split()
+        await self._ensure_fresh(force=len(args) > 1 and args[1] == "刷新")
         page = int(args[1]) if len(args) > 1 and args[1].isdigit() else 1
         total_plugins = len(self.plugins_data)
         if total_plugins == 0:
-            try:
-                img_url = await self.render_plugin_list_image(
-                    [], 0, 1, 0, "AstrBot插件市场"
-                )
-                yield event.image_result(img_url)
-            except:
-                yield event.plain_result("暂无插件数据")
+            yield event.plain_result("暂无插件数据")
             return
-        total_pages = (total_plugins + self.page_size - 1) // self.page_size
-        page = max(1, min(page, total_pages))
-        sorted_plugins = self.sort_plugins(self.plugins_data)
-        start_idx = (page - 1) * self.page_size
-        end_idx = start_idx + self.page_size
-        current_plugins = sorted_plugins[start_idx:end_idx]
-        plugin_items = [
-            {
-                "index": list(self.plugins_data.keys()).index(plugin_key) + 1,
-                "key": plugin_key,
-                "author": str(plugin_info.get("author", "未标注作者")),
-                "desc": str(plugin_info.get("desc", "无描述信息")),
-                "stars": plugin_info.get("stars", 0),
-                "updated_at": self._format_time(plugin_info.get("updated_at", "")),
-            }
-            for plugin_key, plugin_info in current_plugins
-        ]
+        page, total_pages, start_idx, end_idx = self._paginate(total_plugins, page)
+        plugin_items = self._plugin_items[start_idx:end_idx]
         try:
             img_url = await self.render_plugin_list_image(
                 plugins=plugin_items,
@@ -232,47 +649,28 @@ class PluginMarket(Star):
     @filter.command("插件搜索")
     async def search_plugins(self, event: AstrMessageEvent):
         """根据关键词搜索插件"""
-        await self.fetch_plugin_data()
-        input_str = event.message_str.strip()
-        search_part = input_str[4:].strip() if len(input_str) >= 4 else ""
-        if not search_part:
-            yield event.plain_result("请输入搜索关键词，例如：/插件搜索 天气")
-            return
-        parts = search_part.split()
+        await self._ensure_fresh()
+        parts = event.message_str.split()[1:]
         page = 1
-        search_term = ""
         if parts and parts[-1].isdigit():
             try:
-                page = int(parts.pop())
-                search_term = " ".join(parts)
+                page = int(parts[-1])
+                parts.pop()
             except ValueError:
-                search_term = search_part
-        else:
-            search_term = search_part
+                pass
+        search_term = " ".join(parts)
         if not search_term:
             yield event.plain_result("请输入搜索关键词，例如：/插件搜索 天气")
             return
-        matched_plugins = self._filter_plugins_by_search_term(search_term)
-        total_matches = len(matched_plugins)
+        matched_indices = self._filter_plugins_by_search_term(search_term)
+        total_matches = len(matched_indices)
         if total_matches == 0:
             yield event.plain_result(f"未找到包含 '{search_term}' 的插件")
             return
-        total_pages = (total_matches + self.page_size - 1) // self.page_size
-        page = max(1, min(page, total_pages))
-        sorted_matches = sorted(matched_plugins.items(), key=lambda x: x[0])
-        start_idx = (page - 1) * self.page_size
-        end_idx = start_idx + self.page_size
-        current_matches = sorted_matches[start_idx:end_idx]
+        page, total_pages, start_idx, end_idx = self._paginate(total_matches, page)
         plugin_items = [
-            {
-                "index": list(self.plugins_data.keys()).index(plugin_key) + 1,
-                "key": plugin_key,
-                "author": str(plugin_info.get("author", "未标注作者")),
-                "desc": str(plugin_info.get("desc", "无描述信息")),
-                "stars": plugin_info.get("stars", 0),
-                "updated_at": self._format_time(plugin_info.get("updated_at", "")),
-            }
-            for plugin_key, plugin_info in current_matches
+            self._plugin_items[self._key_to_index[self._sorted_keys[i]]]
+            for i in matched_indices[start_idx:end_idx]
         ]
         try:
             img_url = await self.render_plugin_list_image(
@@ -292,40 +690,46 @@ class PluginMarket(Star):
                 f"图片生成失败，搜索 '{search_term}' 共找到{total_matches}个结果"
             )
 
-    def _filter_plugins_by_search_term(self, term: str) -> Dict[str, dict]:
-        if not term:
-            return {}
-        term_lower = term.lower()
-        return {
-            key: plugin
-            for key, plugin in self.plugins_data.items()
-            if term_lower in key.lower()
-            or term_lower in str(plugin.get("desc", "")).lower()
-            or term_lower in str(plugin.get("author", "")).lower()
-        }
+    def _filter_plugins_by_search_term(self, term: str) -> List[int]:
+        """返回匹配插件在_sorted_keys中的下标，多个关键词需全部命中"""
+        tokens = _parse_search_tokens(term)
+        if not tokens:
+            return []
+        first, rest = tokens[0], tokens[1:]
+        corpus, starts, haystacks = (
+            self._search_corpus,
+            self._corpus_starts,
+            self._haystacks,
+        )
+        matched = []
+        pos = corpus.find(first)
+        while pos != -1:
+            i = bisect_right(starts, pos) - 1
+            if all(token in haystacks[i] for token in rest):
+                matched.append(i)
+            # 同一插件只记一次，直接跳到下一个插件的起始位置继续查找
+            pos = corpus.find(first, starts[i] + len(haystacks[i]) + 1)
+        return matched
 
     @filter.command("插件安装")
     @filter.permission_type(filter.PermissionType.ADMIN)
     async def install_plugin(self, event: AstrMessageEvent):
         """通过编号、键名或URL安装插件"""
-        arg = (
-            event.message_str.strip().split()[1]
-            if len(event.message_str.strip().split()) > 1
-            else None
-        )
+        args = event.message_str.split()
+        arg = args[1] if len(args) > 1 else None
         if not arg:
             yield event.plain_result("请指定要安装的插件编号、键名或GitHub仓库URL")
             return
-        display_name = arg
-        if not self._is_github_repo_url(arg):
-            plugin_key = self._get_plugin_key_from_arg(arg)
-            if plugin_key:
-                display_name = plugin_key
+        is_repo_url = self._is_github_repo_url(arg)
+        # 已有数据时不刷新，保证编号与用户刚看到的列表一致
+        if not is_repo_url and not self.plugins_data:
+            await self._ensure_fresh()
+        plugin_key = None if is_repo_url else self._get_plugin_key_from_arg(arg)
+        display_name = plugin_key or arg
         yield event.plain_result(f"开始安装插件: {display_name}...")
         try:
             repo_url = arg
-            if not self._is_github_repo_url(arg):
-                plugin_key = self._get_plugin_key_from_arg(arg)
+            if not is_repo_url:
                 if not plugin_key:
                     yield event.plain_result(f"未在市场中找到插件: {arg}")
                     return
@@ -342,14 +746,11 @@ class PluginMarket(Star):
                 yield event.plain_result(f"插件 '{plugin_name}' 安装并加载成功！")
                 if installed_info.get("readme"):
                     try:
-                        html_body = markdown.markdown(
-                            installed_info["readme"],
-                            extensions=["fenced_code", "tables"],
-                        )
-                        template = self.template_env.get_template(
-                            "readme_template.html"
-                        )
-                        full_html = template.render(readme_body=html_body)
+                        readme = str(installed_info["readme"])
+                        if len(readme) > README_MAX_CHARS:
+                            readme = readme[:README_MAX_CHARS] + "\n\n... (截断)"
+                        html_body = _get_markdown().reset().convert(readme)
+                        full_html = _README_TPL.render(readme_body=html_body)
                         img_url = await self.render_with_fallback(full_html, {})
                         yield event.image_result(img_url)
                     except Exception as e:
@@ -368,26 +769,36 @@ class PluginMarket(Star):
         if not self.plugins_dir.is_dir():
             return []
         valid_dirs = []
-        for d in self.plugins_dir.iterdir():
-            if d.is_dir() and not d.name.endswith("_backup"):
-                if (d / "main.py").is_file():
-                    valid_dirs.append(d)
-        return sorted(valid_dirs, key=lambda p: p.name)
+        # scandir的is_dir复用读取目录时得到的类型信息，先按名称过滤可省去多余的stat
+        with os.scandir(self.plugins_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith("_backup") or not entry.is_dir():
+                    continue
+                if os.path.isfile(os.path.join(entry.path, "main.py")):
+                    valid_dirs.append(Path(entry.path))
+        return sorted(valid_dirs, key=_GET_NAME)
 
     @filter.command("已安装插件")
     async def show_installed_plugins(self, event: AstrMessageEvent):
         """显示本地已安装的插件列表，并生成独立的本地编号"""
-        valid_plugin_dirs = self._get_valid_installed_plugin_dirs()
+        valid_plugin_dirs = await asyncio.to_thread(
+            self._get_valid_installed_plugin_dirs
+        )
         if not valid_plugin_dirs:
             yield event.plain_result("当前未找到任何有效的已安装插件")
             return
 
-        await self.fetch_plugin_data()
-        args = event.message_str.strip().split()
+        await self._ensure_fresh()
+        args = event.message_str.split()
         page = int(args[1]) if len(args) > 1 and args[1].isdigit() else 1
 
+        total_plugins = len(valid_plugin_dirs)
+        page, total_pages, start_idx, end_idx = self._paginate(total_plugins, page)
+
         plugin_items = []
-        for i, plugin_dir in enumerate(valid_plugin_dirs):
+        for i, plugin_dir in enumerate(
+            valid_plugin_dirs[start_idx:end_idx], start_idx
+        ):
             name = plugin_dir.name
             plugin_info = self._get_market_info_case_insensitive(name)
             if not plugin_info:
@@ -405,20 +816,13 @@ class PluginMarket(Star):
                     "author": str(plugin_info.get("author", "未知作者")),
                     "desc": str(plugin_info.get("desc", "无描述信息")),
                     "stars": plugin_info.get("stars", 0),
-                    "updated_at": self._format_time(plugin_info.get("updated_at", "")),
+                    "updated_at": _format_time(plugin_info.get("updated_at", "")),
                 }
             )
 
-        total_plugins = len(plugin_items)
-        total_pages = (total_plugins + self.page_size - 1) // self.page_size
-        page = max(1, min(page, total_pages))
-        start_idx = (page - 1) * self.page_size
-        end_idx = start_idx + self.page_size
-        current_page_items = plugin_items[start_idx:end_idx]
-
         try:
             img_url = await self.render_plugin_list_image(
-                plugins=current_page_items,
+                plugins=plugin_items,
                 total_items=total_plugins,
                 page=page,
                 total_pages=total_pages,
@@ -436,7 +840,7 @@ class PluginMarket(Star):
     @filter.permission_type(filter.PermissionType.ADMIN)
     async def uninstall_plugin(self, event: AstrMessageEvent):
         """通过本地编号或插件名卸载插件"""
-        args = event.message_str.strip().split()
+        args = event.message_str.split()
         if len(args) < 2:
             yield event.plain_result("请输入要卸载的插件的【本地编号】或【文件夹名】")
             return
@@ -446,7 +850,9 @@ class PluginMarket(Star):
 
         if arg.isdigit():
             logger.info(f"参数 '{arg}' 是一个数字，将尝试按本地编号解析...")
-            valid_plugin_dirs = self._get_valid_installed_plugin_dirs()
+            valid_plugin_dirs = await asyncio.to_thread(
+                self._get_valid_installed_plugin_dirs
+            )
             index = int(arg) - 1
             if 0 <= index < len(valid_plugin_dirs):
                 plugin_dir_name_to_uninstall = valid_plugin_dirs[index].name
@@ -492,18 +898,18 @@ class PluginMarket(Star):
         """通过编号或键名，从市场数据中获取插件的唯一键名"""
         try:
             plugin_index = int(arg) - 1
-            sorted_keys = list(self.plugins_data.keys())
-            if 0 <= plugin_index < len(sorted_keys):
-                return sorted_keys[plugin_index]
+            if 0 <= plugin_index < len(self._plugin_keys):
+                return self._plugin_keys[plugin_index]
         except ValueError:
-            lower_arg = arg.lower()
-            for key in self.plugins_data:
-                if key.lower() == lower_arg:
-                    return key
+            return self._lower_key_map.get(arg.lower())
         return None
 
     def _is_github_repo_url(self, url: str) -> bool:
-        return bool(GITHUB_REPO_REGEX.match(url))
+        # 插件编号、键名等常见参数在前缀检查处即被排除，无需进入正则
+        return (
+            url.startswith(GITHUB_URL_PREFIXES)
+            and GITHUB_REPO_REGEX.fullmatch(url) is not None
+        )
 
     def _find_readme_file(self, plugin_path: Path) -> Optional[Path]:
         """查找README.md文件"""
@@ -518,17 +924,14 @@ class PluginMarket(Star):
         self, plugin_dir_name: str
     ) -> Optional[Dict[str, Any]]:
         """查找插件信息"""
-        lower_dir_name = plugin_dir_name.lower()
-        for key, info in self.plugins_data.items():
-            if key.lower() == lower_dir_name:
-                return info
-        return None
+        key = self._lower_key_map.get(plugin_dir_name.lower())
+        return self.plugins_data[key] if key else None
 
     @filter.command("插件排行")
     async def show_plugin_ranking(self, event: AstrMessageEvent):
         """按Star数或更新时间查看插件排行"""
-        await self.fetch_plugin_data()
-        args = event.message_str.strip().split()
+        await self._ensure_fresh()
+        args = event.message_str.split()
         sort_type = "star"
         if len(args) > 1:
             arg = args[1].lower()
@@ -542,22 +945,8 @@ class PluginMarket(Star):
             return
         sorted_plugins = self._sort_plugins_by_type(sort_type)
         total_plugins = len(sorted_plugins)
-        total_pages = (total_plugins + self.page_size - 1) // self.page_size
-        page = max(1, min(page, total_pages))
-        start_idx = (page - 1) * self.page_size
-        end_idx = start_idx + self.page_size
-        current_plugins = sorted_plugins[start_idx:end_idx]
-        plugin_items = [
-            {
-                "index": list(self.plugins_data.keys()).index(plugin_key) + 1,
-                "key": plugin_key,
-                "author": str(plugin_info.get("author", "未标注作者")),
-                "desc": str(plugin_info.get("desc", "无描述信息")),
-                "stars": plugin_info.get("stars", 0),
-                "updated_at": self._format_time(plugin_info.get("updated_at", "")),
-            }
-            for plugin_key, plugin_info in current_plugins
-        ]
+        page, total_pages, start_idx, end_idx = self._paginate(total_plugins, page)
+        plugin_items = sorted_plugins[start_idx:end_idx]
         sort_text = "更新时间" if sort_type == "time" else "Star数量"
         title = f"插件排行榜 (按{sort_text}排序, 第{page}/{total_pages}页)"
         try:
@@ -576,36 +965,9 @@ class PluginMarket(Star):
                 f"图片生成失败，当前按{sort_text}排序，第{page}/{total_pages}页"
             )
 
-    def _sort_plugins_by_type(self, sort_type: str) -> List[tuple]:
-        """根据排序类型对插件进行排序"""
+    def _sort_plugins_by_type(self, sort_type: str) -> List[Dict[str, Any]]:
+        """返回按排序类型预先排好的插件列表，排序在数据刷新时完成"""
         if sort_type == "time":
-            return sorted(
-                self.plugins_data.items(),
-                key=lambda x: x[1].get("updated_at", ""),
-                reverse=True,
-            )
+            return self._ranked_plugins["time"]
         else:
-            return sorted(
-                self.plugins_data.items(),
-                key=lambda x: x[1].get("stars", 0),
-                reverse=True,
-            )
-
-    def _format_time(self, time_str: str) -> str:
-        """格式化时间显示"""
-        if not time_str:
-            return "未知时间"
-        try:
-            if "T" in time_str and "Z" in time_str:
-                return time_str.replace("T", " ").split(".")[0]
-            from datetime import datetime
-
-            for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
-                try:
-                    return datetime.strptime(time_str, fmt).strftime("%Y-%m-%d %H:%M")
-                except ValueError:
-                    pass
-            return time_str
-        except Exception as e:
-            logger.warning(f"时间格式解析失败: {time_str}, 错误: {e}")
-            return time_str
+            return self._ranked_plugins["star"]